@@ -1,9 +1,17 @@
 import yfinance as yf
+from yfinance.exceptions import YFRateLimitError
+from curl_cffi import requests as curl_requests
 import pandas as pd
+import numpy as np
+import xlsxwriter
 from datetime import datetime
 import warnings
 import json
 import os
+import time
+import functools
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Suppress yfinance warnings
 warnings.filterwarnings('ignore', category=FutureWarning)
@@ -12,6 +20,30 @@ warnings.filterwarnings('ignore', category=FutureWarning)
 # CONFIGURATION
 # --------------------------
 CONFIG_FILE = "portfolio.json"
+MAX_WORKERS = 8  # Cap concurrent fundamentals requests to stay within Yahoo rate limits
+FUNDAMENTALS_CACHE_FILE = "fundamentals_cache.json"
+FUNDAMENTALS_CACHE_TTL = 3600  # Seconds; PE, market cap and beta change slowly
+MAX_RETRIES = 5
+RETRY_BACKOFF = 1.0  # Seconds before the first retry, doubled after each failed attempt
+
+# Dashboard sheet columns, in output order
+COLUMNS = (
+    "Stock",
+    "Daily Change %",
+    "Weekly Change %",
+    "Monthly Change %",
+    "YTD Change %",
+    "Yearly Change %",
+    "PE Ratio",
+    "Industry PE",
+    "Market Cap (Cr)",
+    "Dividend Yield %",
+    "Beta",
+)
+
+# One session shared by all Yahoo requests so connections are kept alive and reused.
+# yfinance requires a curl_cffi session (plain requests sessions are rejected).
+SESSION = curl_requests.Session(impersonate="chrome")
 
 def load_portfolio_config():
     """Load portfolio configuration from JSON file"""
@@ -52,6 +84,13 @@ def get_index_symbols(config):
     indexes = config.get('indexes', [])
     return [index['symbol'] for index in indexes]
 
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Generate a portfolio analysis report")
+    parser.add_argument("--format", choices=["xlsx", "parquet"], default="xlsx",
+                        help="Output format: Excel report (default) or Parquet files")
+    return parser.parse_args()
+
 def get_output_file(config):
     """Get output file name from configuration"""
     if not config:
@@ -60,112 +99,251 @@ def get_output_file(config):
     settings = config.get('settings', {})
     return settings.get('output_file', 'Portfolio_Analysis.xlsx')
 
+# --------------------------
+# FUNDAMENTALS CACHE
+# --------------------------
+def load_fundamentals_cache():
+    """Load cached fundamentals from disk, dropping entries older than the TTL"""
+    try:
+        if not os.path.exists(FUNDAMENTALS_CACHE_FILE):
+            return {}
+
+        with open(FUNDAMENTALS_CACHE_FILE, 'r') as file:
+            cache = json.load(file)
+
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"⚠️  Ignoring unreadable fundamentals cache: {e}")
+        return {}
+
+    if not isinstance(cache, dict):
+        print("⚠️  Ignoring unreadable fundamentals cache: expected a mapping of symbols to entries")
+        return {}
+
+    now = time.time()
+    fresh = {}
+    for ticker, entry in cache.items():
+        if (not isinstance(entry, dict)
+                or not isinstance(entry.get('fetched_at'), (int, float))
+                or not isinstance(entry.get('data'), dict)):
+            print(f"⚠️  Ignoring unreadable fundamentals cache entry for {ticker}")
+            continue
+
+        if now - entry['fetched_at'] < FUNDAMENTALS_CACHE_TTL:
+            fresh[ticker] = entry
+
+    return fresh
+
+def save_fundamentals_cache(cache):
+    """Persist fundamentals cache to disk"""
+    try:
+        with open(FUNDAMENTALS_CACHE_FILE, 'w') as file:
+            json.dump(cache, file, indent=2)
+    except OSError as e:
+        print(f"⚠️  Could not save fundamentals cache: {e}")
+
+# --------------------------
+# FUNCTION: Retry with backoff
+# --------------------------
+class IncompleteInfoError(Exception):
+    """Yahoo returned no or partial quote data, typically because an endpoint answered 5xx"""
+
+def with_retries(fetch, ticker):
+    """Call fetch(ticker), retrying rate limits, network errors and incomplete data with exponential backoff"""
+    for attempt in range(MAX_RETRIES):
+        try:
+            return fetch(ticker)
+        except (YFRateLimitError, curl_requests.RequestsError, IncompleteInfoError) as e:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            
+            delay = RETRY_BACKOFF * 2 ** attempt
+            print(f"⏳ {ticker}: {str(e)} - retrying in {delay:.0f}s...")
+            time.sleep(delay)
+
 # --------------------------
 # FUNCTION: Fetch PE ratios
 # --------------------------
-def get_pe_ratios(ticker):
+@functools.lru_cache(maxsize=128)
+def fetch_fundamentals(ticker):
+    """Fetch fundamentals for a ticker, memoized as an immutable tuple of items for the run"""
+    # Create Ticker object
+    stock = yf.Ticker(ticker, session=SESSION)
+    
+    # Get financial info. yfinance logs and swallows 5xx responses: if the quote endpoint
+    # fails, parsing the missing payload raises TypeError; if only quoteSummary fails,
+    # info lacks every quoteSummary module (each carries maxAge). Raise so it's retried
+    # rather than cached as a completed lookup.
     try:
-        # Create Ticker object
-        stock = yf.Ticker(ticker)
-        
-        # Get financial info
         info = stock.info
-        
-        # Extract PE ratios
-        pe_ratio = info.get('trailingPE', None)
-        industry_pe = info.get('industryPE', None)
-        
-        # Try alternative sources for industry PE
-        if industry_pe is None:
-            # Try sector PE or forward PE as alternatives
-            industry_pe = info.get('sectorPE', info.get('forwardPE', None))
-        
-        # For ETFs and indexes, PE might not be available
-        if ticker.endswith('.NS') and (pe_ratio is None or pe_ratio == 0):
-            print(f"⚠️  PE data not available for {ticker}")
-            return {"PE Ratio": None, "Industry PE": None}
-        
-        # Get additional fundamental metrics
-        market_cap = info.get('marketCap', None)
-        dividend_yield = info.get('dividendYield', None)
-        beta = info.get('beta', None)
-        
-        return {
-            "PE Ratio": pe_ratio,
-            "Industry PE": industry_pe,
-            "Market Cap (Cr)": market_cap / 10000000 if market_cap else None,  # Convert to Crores
-            "Dividend Yield %": dividend_yield * 100 if dividend_yield else None,  # Convert to percentage
-            "Beta": beta
-        }
+    except TypeError as e:
+        raise IncompleteInfoError(f"no quote data returned ({e})")
+    if 'maxAge' not in info:
+        raise IncompleteInfoError("quote summary data missing")
+    
+    # Extract PE ratios
+    pe_ratio = info.get('trailingPE', None)
+    industry_pe = info.get('industryPE', None)
+    
+    # Try alternative sources for industry PE
+    if industry_pe is None:
+        # Try sector PE or forward PE as alternatives
+        industry_pe = info.get('sectorPE', info.get('forwardPE', None))
+    
+    # For ETFs and indexes, PE might not be available
+    if ticker.endswith('.NS') and (pe_ratio is None or pe_ratio == 0):
+        print(f"⚠️  PE data not available for {ticker}")
+        return (("PE Ratio", None), ("Industry PE", None))
+    
+    # Get additional fundamental metrics
+    market_cap = info.get('marketCap', None)
+    dividend_yield = info.get('dividendYield', None)
+    beta = info.get('beta', None)
+    
+    return (
+        ("PE Ratio", pe_ratio),
+        ("Industry PE", industry_pe),
+        ("Market Cap (Cr)", market_cap / 10000000 if market_cap else None),  # Convert to Crores
+        ("Dividend Yield %", dividend_yield * 100 if dividend_yield else None),  # Convert to percentage
+        ("Beta", beta)
+    )
+
+def get_pe_ratios(ticker):
+    try:
+        # Copy into a fresh dict so callers can't mutate the memoized result
+        return dict(with_retries(fetch_fundamentals, ticker))
         
     except Exception as e:
         print(f"❌ Error fetching PE data for {ticker}: {str(e)}")
-        return {"PE Ratio": None, "Industry PE": None}
+        return None
+
+def record_pe_result(pe_map, cache, ticker, pe_data):
+    """Store a finished PE lookup, caching it unless the lookup failed"""
+    # Only cache completed lookups so failures are retried next run
+    if pe_data is None:
+        pe_map[ticker] = {"PE Ratio": None, "Industry PE": None}
+    else:
+        pe_map[ticker] = pe_data
+        cache[ticker] = {"fetched_at": time.time(), "data": pe_data}
+
+def fetch_pe_ratios(tickers):
+    """Fetch PE data for all tickers concurrently, reusing fresh cached entries"""
+    cache = load_fundamentals_cache()
+    pe_map = {ticker: cache[ticker]['data'] for ticker in tickers if ticker in cache}
+    if pe_map:
+        print(f"💾 Using cached fundamentals for {len(pe_map)} symbols")
+
+    to_fetch = [ticker for ticker in tickers if ticker not in pe_map]
+    if not to_fetch:
+        return pe_map
+
+    executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    pe_futures = {}
+    try:
+        pe_futures = {executor.submit(get_pe_ratios, ticker): ticker for ticker in to_fetch}
+        for future in as_completed(pe_futures):
+            record_pe_result(pe_map, cache, pe_futures[future], future.result())
+
+    finally:
+        # Don't wait on in-flight lookups (they may be backing off), but keep every
+        # lookup that finished so an interrupted run doesn't lose completed work
+        executor.shutdown(wait=False, cancel_futures=True)
+        for future, ticker in pe_futures.items():
+            if ticker not in pe_map and future.done() and not future.cancelled() and future.exception() is None:
+                record_pe_result(pe_map, cache, ticker, future.result())
+        save_fundamentals_cache(cache)
+
+    return pe_map
+
+# --------------------------
+# FUNCTION: Download price history
+# --------------------------
+def fetch_close_prices(tickers):
+    """Download one year of daily close prices for the tickers in a single batched request"""
+    try:
+        data = yf.download(tickers, period="1y", interval="1d", group_by="ticker", multi_level_index=True,
+                           threads=True, progress=False, auto_adjust=True, session=SESSION)
+        if data is None or data.empty:
+            return pd.DataFrame()
+
+        # Keep only the close prices as a flat (date x ticker) frame
+        return data.xs('Close', axis=1, level=1)
+
+    except Exception as e:
+        print(f"❌ Error downloading price history: {str(e)}")
+        return pd.DataFrame()
+
+def download_close_prices(tickers):
+    """Download close prices for all tickers, re-requesting any that come back empty with exponential backoff"""
+    close_prices = fetch_close_prices(tickers)
+
+    # yf.download swallows per-ticker failures (including rate limits), leaving those
+    # symbols missing or all-NaN, so retry just those symbols
+    for attempt in range(MAX_RETRIES - 1):
+        missing = [
+            ticker for ticker in dict.fromkeys(tickers)
+            if ticker not in close_prices.columns or close_prices[ticker].isna().all()
+        ]
+        if not missing:
+            break
+
+        delay = RETRY_BACKOFF * 2 ** attempt
+        print(f"⏳ No price history for {', '.join(missing)} - retrying in {delay:.0f}s...")
+        time.sleep(delay)
+
+        # Prefer freshly downloaded prices, keeping the earlier download for everything else
+        close_prices = fetch_close_prices(missing).combine_first(close_prices)
+
+    return close_prices
+
+def get_close_data(close_prices, ticker):
+    """Select the close price series for a ticker from the batched download"""
+    if ticker not in close_prices.columns:
+        return None
+
+    return close_prices[ticker].dropna()
 
 # --------------------------
 # FUNCTION: Fetch stock changes
 # --------------------------
-def get_price_changes(ticker):
+def get_price_changes(close_data, ticker):
     try:
-        # Download single ticker to avoid MultiIndex issues
-        data = yf.download(ticker, period="1y", interval="1d", progress=False, auto_adjust=True)
-        
-        if data.empty or len(data) < 30:  # Need at least 30 days of data
+        if close_data is None or len(close_data) < 30:  # Need at least 30 days of data
             print(f"⚠️  Insufficient data for {ticker}")
             return None
 
-        # Get close data - handle MultiIndex columns
-        if isinstance(data.columns, pd.MultiIndex):
-            close_data = data[('Close', ticker)]
-        else:
-            close_data = data['Close']
-        
-        # Get the latest close price as a scalar
-        last_close = float(close_data.iloc[-1])
-        
-        # Calculate changes for different periods
-        changes = {}
-        
-        # Daily change (if we have at least 2 days of data)
-        if len(close_data) >= 2:
-            prev_close = float(close_data.iloc[-2])
-            daily_change = ((last_close - prev_close) / prev_close) * 100
-            changes["Daily Change %"] = daily_change
-        else:
-            changes["Daily Change %"] = None
-            
-        # Weekly change (5 trading days)
-        if len(close_data) >= 5:
-            week_ago_close = float(close_data.iloc[-5])
-            weekly_change = ((last_close - week_ago_close) / week_ago_close) * 100
-            changes["Weekly Change %"] = weekly_change
-        else:
-            changes["Weekly Change %"] = None
-            
-        # Monthly change (21 trading days)
-        if len(close_data) >= 21:
-            month_ago_close = float(close_data.iloc[-21])
-            monthly_change = ((last_close - month_ago_close) / month_ago_close) * 100
-            changes["Monthly Change %"] = monthly_change
-        else:
-            changes["Monthly Change %"] = None
+        # Work on the raw close prices (float32 is ample for 2-decimal percentages)
+        # so all windowed returns are computed in one pass
+        closes = close_data.to_numpy(dtype=np.float32)
+        last_close = closes[-1]
+
+        # Daily, weekly (5 trading days) and monthly (21 trading days) changes
+        lookbacks = np.array([2, 5, 21])
+        prev_closes = closes[-lookbacks]
+        daily_change, weekly_change, monthly_change = (last_close - prev_closes) / prev_closes * 100.0
+
+        changes = {
+            "Daily Change %": float(daily_change),
+            "Weekly Change %": float(weekly_change),
+            "Monthly Change %": float(monthly_change),
+        }
             
         # YTD change (from start of year)
-        current_year = datetime.now().year
-        year_start_data = close_data[close_data.index.year == current_year]
-        if not year_start_data.empty:
-            year_start_close = float(year_start_data.iloc[0])
+        # The index is sorted, so binary search for the first close on or after Jan 1
+        year_start = pd.Timestamp(year=datetime.now().year, month=1, day=1, tz=close_data.index.tz)
+        year_start_pos = close_data.index.searchsorted(year_start)
+        if year_start_pos < len(closes):
+            year_start_close = closes[year_start_pos]
             ytd_change = ((last_close - year_start_close) / year_start_close) * 100
-            changes["YTD Change %"] = ytd_change
+            changes["YTD Change %"] = float(ytd_change)
         else:
             changes["YTD Change %"] = None
             
         # Yearly change (from 1 year ago)
-        if len(close_data) >= 240:  # At least 240 trading days (roughly 11 months)
+        if len(closes) >= 240:  # At least 240 trading days (roughly 11 months)
             # Use the first available data point (approximately 1 year ago)
-            year_ago_close = float(close_data.iloc[0])
+            year_ago_close = closes[0]
             yearly_change = ((last_close - year_ago_close) / year_ago_close) * 100
-            changes["Yearly Change %"] = yearly_change
+            changes["Yearly Change %"] = float(yearly_change)
         else:
             changes["Yearly Change %"] = None
 
@@ -175,10 +353,38 @@ def get_price_changes(ticker):
         print(f"❌ Error fetching {ticker}: {str(e)}")
         return None
 
+# --------------------------
+# FUNCTION: Write Excel report
+# --------------------------
+def to_excel_value(value):
+    """Convert a cell value for xlsxwriter, matching pandas' to_excel for missing and infinite values"""
+    # Missing values become empty cells and infinities are written as text
+    if pd.isna(value):
+        return None
+    if isinstance(value, float) and np.isinf(value):
+        return "inf" if value > 0 else "-inf"
+    return value
+
+def write_excel_report(output_file, sheets):
+    """Write each DataFrame to its own sheet, streaming rows to disk in constant memory mode"""
+    # pandas' to_excel writes cells column by column, but constant_memory mode only
+    # accepts rows in order, so rows are written directly with xlsxwriter
+    with xlsxwriter.Workbook(output_file, {'constant_memory': True}) as workbook:
+        header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        
+        for sheet_name, df in sheets.items():
+            worksheet = workbook.add_worksheet(sheet_name)
+            worksheet.write_row(0, 0, list(df.columns), header_format)
+            
+            rows = df.itertuples(index=False, name=None)
+            for row_idx, row in enumerate(rows, start=1):
+                worksheet.write_row(row_idx, 0, [to_excel_value(value) for value in row])
+
 # --------------------------
 # MAIN SCRIPT
 # --------------------------
 if __name__ == "__main__":
+    args = parse_args()
     print("📊 Starting Portfolio Analysis...")
     dashboard_data = []
 
@@ -213,58 +419,38 @@ if __name__ == "__main__":
     
     print(f"\n🚀 Starting data analysis...\n")
 
-    for stock in stocks_to_fetch + indexes_to_fetch:
+    symbols = stocks_to_fetch + indexes_to_fetch
+
+    # Fetch price history for all symbols in one request
+    print(f"📥 Downloading price history for {len(symbols)} symbols...")
+    close_prices = download_close_prices(symbols)
+
+    # Fetch fundamentals for all symbols concurrently
+    print(f"📥 Fetching fundamentals for {len(symbols)} symbols...")
+    pe_map = fetch_pe_ratios(symbols)
+
+    for stock in symbols:
         print(f"📈 Fetching data for {stock}...")
-        changes = get_price_changes(stock)
-        pe_data = get_pe_ratios(stock)
+        changes = get_price_changes(get_close_data(close_prices, stock), stock)
+        pe_data = pe_map[stock]
         
+        # Start from an empty row so every record has the full dashboard schema
+        stock_data = {col: None for col in COLUMNS}
+        stock_data.update({"Stock": stock, **(changes or {}), **pe_data})
+        dashboard_data.append(stock_data)
+
         if changes:
-            # Combine price changes and PE data
-            stock_data = {"Stock": stock, **changes, **pe_data}
-            dashboard_data.append(stock_data)
             print(f"✅ Successfully fetched data for {stock}")
         else:
-            dashboard_data.append({
-                "Stock": stock, 
-                "Daily Change %": None, 
-                "Weekly Change %": None,
-                "Monthly Change %": None, 
-                "YTD Change %": None, 
-                "Yearly Change %": None,
-                "PE Ratio": pe_data.get("PE Ratio", None),
-                "Industry PE": pe_data.get("Industry PE", None),
-                "Market Cap (Cr)": pe_data.get("Market Cap (Cr)", None),
-                "Dividend Yield %": pe_data.get("Dividend Yield %", None),
-                "Beta": pe_data.get("Beta", None)
-            })
             print(f"❌ Failed to fetch price data for {stock}")
 
-    # Convert to DataFrame
-    dashboard_df = pd.DataFrame(dashboard_data)
+    # Convert to DataFrame with a fixed column order
+    dashboard_df = pd.DataFrame.from_records(dashboard_data, columns=COLUMNS)
     
-    # Round percentage columns to 2 decimal places
-    percentage_columns = [col for col in dashboard_df.columns if "Change %" in col]
-    for col in percentage_columns:
-        # Convert to numeric, handling None values
-        dashboard_df[col] = pd.to_numeric(dashboard_df[col], errors='coerce').round(2)
-    
-    # Round PE ratio columns to 2 decimal places
-    pe_columns = ["PE Ratio", "Industry PE"]
-    for col in pe_columns:
-        if col in dashboard_df.columns:
-            dashboard_df[col] = pd.to_numeric(dashboard_df[col], errors='coerce').round(2)
-    
-    # Round market cap to 2 decimal places
-    if "Market Cap (Cr)" in dashboard_df.columns:
-        dashboard_df["Market Cap (Cr)"] = pd.to_numeric(dashboard_df["Market Cap (Cr)"], errors='coerce').round(2)
-    
-    # Round dividend yield to 2 decimal places
-    if "Dividend Yield %" in dashboard_df.columns:
-        dashboard_df["Dividend Yield %"] = pd.to_numeric(dashboard_df["Dividend Yield %"], errors='coerce').round(2)
-    
-    # Round beta to 2 decimal places
-    if "Beta" in dashboard_df.columns:
-        dashboard_df["Beta"] = pd.to_numeric(dashboard_df["Beta"], errors='coerce').round(2)
+    # Convert all metric columns to numeric (handling None values) and round to 2 decimal places
+    numeric_columns = list(COLUMNS[1:])
+    dashboard_df[numeric_columns] = dashboard_df[numeric_columns].apply(pd.to_numeric, errors='coerce').round(2)
+    percentage_columns = [col for col in numeric_columns if "Change %" in col]
 
     # Placeholder News Data
     news_df = pd.DataFrame([
@@ -274,24 +460,29 @@ if __name__ == "__main__":
          "Published At": "2025-01-09", "URL": "https://business-standard.com"},
     ])
 
-    # Save to Excel
+    # Save report
     try:
-        with pd.ExcelWriter(output_file, engine="xlsxwriter") as writer:
-            dashboard_df.to_excel(writer, sheet_name="Dashboard", index=False)
-            news_df.to_excel(writer, sheet_name="News Feed", index=False)
+        if args.format == "parquet":
+            # Columnar output, one file per sheet
+            output_base = os.path.splitext(output_file)[0]
+            output_file = f"{output_base}.parquet"
+            dashboard_df.to_parquet(output_file, engine="pyarrow", compression="snappy", index=False)
+            news_df.to_parquet(f"{output_base}_News.parquet", engine="pyarrow", compression="snappy", index=False)
+        else:
+            write_excel_report(output_file, {"Dashboard": dashboard_df, "News Feed": news_df})
         
         print(f"✅ Portfolio analysis saved to {output_file}")
         print(f"📋 Processed {len(dashboard_data)} stocks/indexes")
         
         # Display summary
         print("\n📊 Summary:")
-        successful_fetches = len([row for row in dashboard_data if any(row.get(col) is not None for col in percentage_columns)])
+        successful_fetches = int(dashboard_df[percentage_columns].notna().any(axis=1).sum())
         print(f"   - Successfully fetched: {successful_fetches}/{len(dashboard_data)}")
         print(f"   - Failed fetches: {len(dashboard_data) - successful_fetches}/{len(dashboard_data)}")
         
     except Exception as e:
-        print(f"❌ Error saving to Excel: {str(e)}")
-        # Fallback to CSV if Excel fails
+        print(f"❌ Error saving to {args.format}: {str(e)}")
+        # Fallback to CSV if the report can't be written
         dashboard_df.to_csv("Portfolio_Analysis.csv", index=False)
         news_df.to_csv("News_Feed.csv", index=False)
         print("✅ Saved as CSV files instead")
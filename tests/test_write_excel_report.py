@@ -0,0 +1,63 @@
+import os
+import sys
+import tempfile
+import unittest
+import warnings
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import write_excel_report
+
+
+class WriteExcelReportTest(unittest.TestCase):
+    def write_and_read(self, sheets):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_file = os.path.join(tmp_dir, "report.xlsx")
+            # main silences FutureWarnings globally; surface them here so pandas deprecations fail the test
+            with warnings.catch_warnings():
+                warnings.simplefilter("error", FutureWarning)
+                write_excel_report(output_file, sheets)
+            return pd.read_excel(output_file, sheet_name=None)
+
+    def test_writes_missing_values_without_infinities(self):
+        dashboard_df = pd.DataFrame({
+            "Stock": ["A.NS", "B.NS"],
+            "PE Ratio": [12.0, np.nan],
+        })
+
+        dashboard = self.write_and_read({"Dashboard": dashboard_df})["Dashboard"]
+
+        self.assertEqual(dashboard["Stock"].tolist(), ["A.NS", "B.NS"])
+        self.assertEqual(dashboard["PE Ratio"].iloc[0], 12.0)
+        self.assertTrue(pd.isna(dashboard["PE Ratio"].iloc[1]))
+
+    def test_writes_missing_and_infinite_values(self):
+        dashboard_df = pd.DataFrame({
+            "Stock": ["A.NS", "B.NS", "C.NS"],
+            "PE Ratio": [12.5, np.inf, np.nan],
+            "Market Cap (Cr)": [-np.inf, 250.0, 300.0],
+            "Beta": [1.1, np.nan, 0.9],
+        })
+        news_df = pd.DataFrame([{"Stock": "A.NS", "Headline": "Headline"}])
+
+        sheets = self.write_and_read({"Dashboard": dashboard_df, "News Feed": news_df})
+
+        dashboard = sheets["Dashboard"]
+        self.assertEqual(list(dashboard.columns), ["Stock", "PE Ratio", "Market Cap (Cr)", "Beta"])
+        self.assertEqual(dashboard["Stock"].tolist(), ["A.NS", "B.NS", "C.NS"])
+        self.assertEqual(dashboard["PE Ratio"].iloc[0], 12.5)
+        self.assertTrue(np.isposinf(dashboard["PE Ratio"].iloc[1]))
+        self.assertTrue(pd.isna(dashboard["PE Ratio"].iloc[2]))
+        self.assertTrue(np.isneginf(dashboard["Market Cap (Cr)"].iloc[0]))
+        self.assertEqual(dashboard["Market Cap (Cr)"].tolist()[1:], [250.0, 300.0])
+        self.assertEqual(dashboard["Beta"].iloc[0], 1.1)
+        self.assertTrue(pd.isna(dashboard["Beta"].iloc[1]))
+        self.assertEqual(dashboard["Beta"].iloc[2], 0.9)
+        self.assertEqual(sheets["News Feed"].to_dict("records"), [{"Stock": "A.NS", "Headline": "Headline"}])
+
+
+if __name__ == "__main__":
+    unittest.main()